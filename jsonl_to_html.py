@@ -8,16 +8,138 @@ Media-aware: Downloads all images and videos from posts and comments.
 import json
 import html as html_lib
 import os
+import functools
 import hashlib
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import HTTPError as Urllib3HTTPError
+from urllib3.util.retry import Retry
 import re
+import shutil
+import sys
 import time
 import argparse
+import asyncio
 import glob
+import itertools
+from datetime import datetime, timezone
 from urllib.parse import urlparse, parse_qs
 from pathlib import Path
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from threading import Lock
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+# Shared HTTP session so download workers reuse keep-alive connections
+# instead of doing a fresh TCP/TLS handshake for every media file
+SESSION = requests.Session()
+# Transient CDN errors (502/503/504) are retried with backoff inside the
+# adapter; connection errors and other statuses are left to the retry loop
+# in download_media, which also switches headers. Retry-After is ignored,
+# otherwise a rate-limited 429 would be retried too, sleeping for however
+# long the server asks. The pool is sized for large --workers values;
+# connections are only opened as needed
+_adapter = HTTPAdapter(
+    pool_connections=64,
+    pool_maxsize=256,
+    max_retries=Retry(
+        total=2, connect=0, read=0, status=2, backoff_factor=0.5,
+        status_forcelist=(502, 503, 504), respect_retry_after_header=False,
+    ),
+)
+SESSION.mount('http://', _adapter)
+SESSION.mount('https://', _adapter)
+_DEFAULT_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
+    'Accept': 'image/webp,image/*,*/*;q=0.8',
+    'Referer': 'https://www.reddit.com/',
+}
+SESSION.headers.update(_DEFAULT_HEADERS)
+# Headers for the retry attempt (None drops the session default)
+_FALLBACK_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (X11; Linux x86_64; rv:120.0) Gecko/20100101 Firefox/120.0',
+    'Accept': '*/*',
+    'Referer': None,
+}
+
+# Media URL patterns, kept as separate regexes so each one starts with the
+# literal "http" prefix that the regex engine can scan for quickly
+_MEDIA_URL_PATTERNS = [
+    re.compile(p, re.IGNORECASE) for p in (
+        r'https?://(?:preview\.|i\.|v\.)?redd\.it/[^\s<>")\]]+',
+        r'https?://[^\s<>")\]]+\.(?:jpg|jpeg|png|gif|webp|svg|bmp|ico)',
+        r'https?://[^\s<>")\]]+\.(?:mp4|avi|mov|wmv|flv|webm|m4v|mpg|mpeg)',
+        r'https?://(?:i\.)?imgur\.com/[^\s<>")\]]+',
+    )
+]
+
+# giphy|ID embeds, bare or wrapped in markdown: ![gif](giphy|ID) or [gif](giphy|ID)
+_GIPHY_RE = re.compile(r'(?:!?\[[^\]]*\]\()?giphy\|([A-Za-z0-9]+)\)?', re.IGNORECASE)
+# The same, capturing the markdown prefix (group 1) and the ID (group 2)
+_GIPHY_REPLACE_RE = re.compile(r'(!?\[[^\]]*\]\()?giphy\|([A-Za-z0-9]+)(\))?', re.IGNORECASE)
+
+# Hosts/extensions that mark a post's url field as media
+_MEDIA_DOMAIN_RE = re.compile(r'redd\.it|imgur\.com|\.(?:jpe?g|png|gif|webp|mp4|webm)')
+
+
+def json_loads(data):
+    """Parse JSON (str or bytes), using orjson when it's installed
+
+    orjson is stricter than the stdlib parser (e.g. NaN, lone surrogates),
+    so anything it rejects is retried with json.loads.
+    """
+    if orjson is not None:
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            pass
+    return json.loads(data)
+
+
+# Stdlib fallback for json_dumps(); posts are plain dicts/lists, so the
+# circular-reference check only costs time
+_JSON_ENCODER = json.JSONEncoder(ensure_ascii=False, check_circular=False, separators=(',', ':'))
+
+
+def json_dumps(obj):
+    """Serialize obj to compact UTF-8 JSON bytes, using orjson when it's installed
+    
+    Anything orjson refuses (e.g. integers over 64 bits, lone surrogates,
+    very deep nesting) is encoded with the stdlib encoder instead.
+    """
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj)
+        except orjson.JSONEncodeError:
+            pass
+    return _JSON_ENCODER.encode(obj).encode('utf-8')
+
+
+@functools.lru_cache(maxsize=1 << 16)
+def _unescape_url(url):
+    """html.unescape() for URLs, which repeat across posts and passes"""
+    return html_lib.unescape(url)
+
+
+def unescape_url(url):
+    """Decode HTML entities in a URL (Reddit escapes '&' in query strings)"""
+    # Entities always start with '&', so most URLs need no work at all
+    if '&' not in url:
+        return url
+    return _unescape_url(url)
 
 
 def extract_media_urls_from_text(text):
@@ -26,59 +148,45 @@ def extract_media_urls_from_text(text):
         return []
     
     urls = []
-    patterns = [
-        r'https?://(?:preview\.|i\.|v\.)?redd\.it/[^\s<>")\]]+',
-        r'https?://[^\s<>")\]]+\.(?:jpg|jpeg|png|gif|webp|svg|bmp|ico)',
-        r'https?://[^\s<>")\]]+\.(?:mp4|avi|mov|wmv|flv|webm|m4v|mpg|mpeg)',
-        r'https?://(?:i\.)?imgur\.com/[^\s<>")\]]+',
-    ]
-    
     found_urls = set()
-    for pattern in patterns:
-        matches = re.findall(pattern, text, re.IGNORECASE)
-        for match in matches:
-            match = match.rstrip('.,;:!?)')
-            if match not in found_urls:
-                found_urls.add(match)
-                urls.append(match)
-    
-    # Extract giphy links: ![gif](giphy|ID) or [gif](giphy|ID)
-    giphy_pattern = r'(?:!?\[[^\]]*\]\()?giphy\|([A-Za-z0-9]+)\)?'
-    giphy_matches = re.findall(giphy_pattern, text, re.IGNORECASE)
-    for giphy_id in giphy_matches:
-        # Convert giphy ID to URL
-        # Try different giphy URL formats
-        giphy_urls = [
-            f'https://media.giphy.com/media/{giphy_id}/giphy.gif',
-            f'https://i.giphy.com/{giphy_id}.gif',
-            f'https://media.giphy.com/media/{giphy_id}/200.gif',
-        ]
-        # Add the most common format
-        if f'giphy|{giphy_id}' not in found_urls:
-            found_urls.add(f'giphy|{giphy_id}')
-            urls.append(giphy_urls[0])  # Use the first format, we'll try others if this fails
+    
+    # Every media pattern needs a scheme, so skip the scans for plain text
+    if '://' in text:
+        for pattern in _MEDIA_URL_PATTERNS:
+            for m in pattern.finditer(text):
+                match = m.group(0).rstrip('.,;:!?)')
+                if match not in found_urls:
+                    found_urls.add(match)
+                    urls.append(match)
+    
+    # Extract giphy links: ![gif](giphy|ID) or [gif](giphy|ID); every
+    # match has a '|', which also covers upper-case "GIPHY|"
+    giphy_ids = _GIPHY_RE.findall(text) if '|' in text else ()
+    for giphy_id in giphy_ids:
+        # Convert giphy ID to its direct media URL (the most common format)
+        giphy_key = f'giphy|{giphy_id}'
+        if giphy_key not in found_urls:
+            found_urls.add(giphy_key)
+            urls.append(f'https://media.giphy.com/media/{giphy_id}/giphy.gif')
     
     return urls
 
 
+def _is_media_url(url):
+    """Check whether a post's url field points at media we can download"""
+    return isinstance(url, str) and url.startswith('http') and _MEDIA_DOMAIN_RE.search(url) is not None
+
+
 def extract_media_from_reddit_post(post_data):
     """Extract all media URLs from a Reddit post data structure"""
     media_urls = set()
     
-    # Direct URL field (can be image/video URLs)
-    if 'url' in post_data:
-        url = post_data['url']
-        if url and isinstance(url, str) and url.startswith('http'):
-            # Skip non-media URLs (reddit.com links, etc.)
-            if any(domain in url for domain in ['redd.it', 'imgur.com', '.jpg', '.jpeg', '.png', '.gif', '.webp', '.mp4', '.webm']):
-                media_urls.add(url)
-    
-    # URL override (often the actual media URL)
-    if 'url_overridden_by_dest' in post_data:
-        url = post_data['url_overridden_by_dest']
-        if url and isinstance(url, str) and url.startswith('http'):
-            if any(domain in url for domain in ['redd.it', 'imgur.com', '.jpg', '.jpeg', '.png', '.gif', '.webp', '.mp4', '.webm']):
-                media_urls.add(url)
+    # Direct URL field (can be image/video URLs) and the URL override
+    # (often the actual media URL); non-media links like reddit.com are skipped
+    for field in ('url', 'url_overridden_by_dest'):
+        url = post_data.get(field)
+        if _is_media_url(url):
+            media_urls.add(url)
     
     # Thumbnail
     if 'thumbnail' in post_data:
@@ -96,7 +204,7 @@ def extract_media_from_reddit_post(post_data):
                     src_url = img['source'].get('url')
                     if src_url and isinstance(src_url, str) and src_url.startswith('http'):
                         # Decode HTML entities in URL
-                        src_url = html_lib.unescape(src_url)
+                        src_url = unescape_url(src_url)
                         media_urls.add(src_url)
                 # Variants (higher res versions)
                 if 'variants' in img and isinstance(img['variants'], dict):
@@ -104,7 +212,7 @@ def extract_media_from_reddit_post(post_data):
                         if isinstance(variant, dict) and 'source' in variant:
                             var_url = variant['source'].get('url')
                             if var_url and isinstance(var_url, str) and var_url.startswith('http'):
-                                var_url = html_lib.unescape(var_url)
+                                var_url = unescape_url(var_url)
                                 media_urls.add(var_url)
     
     # Gallery data
@@ -119,7 +227,7 @@ def extract_media_from_reddit_post(post_data):
                 if 's' in media_info and isinstance(media_info['s'], dict):
                     img_url = media_info['s'].get('u')
                     if img_url and isinstance(img_url, str) and img_url.startswith('http'):
-                        img_url = html_lib.unescape(img_url)
+                        img_url = unescape_url(img_url)
                         media_urls.add(img_url)
     
     # Extract from selftext body
@@ -141,17 +249,61 @@ def extract_media_from_comment(comment_data):
     return media_urls
 
 
+def _extract_media_from_replies(replies, media_urls):
+    """Append media URLs from a comment's replies Listing, at any depth, to the media_urls list"""
+    stack = [replies]
+    while stack:
+        replies_listing = stack.pop()
+        if not isinstance(replies_listing, dict) or replies_listing.get('kind') != 'Listing':
+            continue
+        for reply_item in replies_listing['data'].get('children', []):
+            if reply_item.get('kind') == 't1':
+                reply_data = reply_item.get('data', {})
+                media_urls.extend(extract_media_from_comment(reply_data))
+                if reply_data.get('replies'):
+                    stack.append(reply_data['replies'])
+
+
+# scheme://host/.../name.ext where .ext is a known media extension ending the
+# URL path (before any ?query or #fragment). Only matches URLs for which
+# urlparse + splitext would give the same extension; anything else falls
+# through to the general parsing in get_local_path_for_url
+_PATH_EXT_RE = re.compile(
+    r'^[a-z][a-z0-9+.-]*://[^/?#\s]*(?:/[^?#\s]*)?/'
+    r'[^/?#;\s]*[^/.?#;\s][^/?#;\s]*\.(jpe?g|png|gif|webp|svg|mp4|webm)(?=[?#]|$)',
+    re.IGNORECASE
+)
+
+
+@functools.lru_cache(maxsize=None)
+def _media_dir_prefix(media_dir):
+    """media_dir with a trailing separator, so prefix + name == os.path.join(media_dir, name)"""
+    return os.path.join(media_dir, '')
+
+
+@functools.lru_cache(maxsize=200_000)
 def get_local_path_for_url(url, media_dir):
-    """Generate local path for a URL without downloading"""
-    url_decoded = html_lib.unescape(url)
-    url_hash = hashlib.md5(url_decoded.encode()).hexdigest()[:16]
+    """Generate local path for a URL without downloading
+
+    Memoized per (url, media_dir) since the same URLs come up repeatedly.
+    """
+    url_decoded = unescape_url(url)
+    # The hash only names files, it doesn't need to be cryptographically secure
+    url_hash = hashlib.md5(url_decoded.encode(), usedforsecurity=False).hexdigest()[:16]
+    
+    # Common case: the path already ends in a known media extension
+    ext_match = _PATH_EXT_RE.match(url_decoded)
+    if ext_match:
+        return f"{_media_dir_prefix(media_dir)}{url_hash}.{ext_match.group(1).lower()}"
     
     parsed_url = urlparse(url_decoded)
     path = parsed_url.path
     ext = os.path.splitext(path)[1].lower()
     
     if not ext or ext not in ['.jpg', '.jpeg', '.png', '.gif', '.webp', '.svg', '.mp4', '.webm']:
-        query_params = parse_qs(parsed_url.query)
+        # Only parse the query string when it can hold a (possibly %-encoded) format hint
+        query = parsed_url.query
+        query_params = parse_qs(query) if 'format' in query or '%' in query else {}
         if 'format' in query_params:
             format_hint = query_params['format'][0].lower()
             ext = {'png': '.png', 'gif': '.gif', 'webp': '.webp'}.get(format_hint, '.jpg')
@@ -169,26 +321,37 @@ def get_local_path_for_url(url, media_dir):
                 ext = '.jpg'
     
     local_filename = f"{url_hash}{ext}"
-    return os.path.join(media_dir, local_filename)
+    return _media_dir_prefix(media_dir) + local_filename
 
 
-def download_media(url, media_dir, url_to_local_path, lock):
-    """Download media from URL and return local path"""
-    url_decoded = html_lib.unescape(url)
-    
-    with lock:
-        if url_decoded in url_to_local_path:
-            return url_to_local_path[url_decoded]
-        if url in url_to_local_path:
-            return url_to_local_path[url]
-    
-    local_path = get_local_path_for_url(url, media_dir)
-    
-    if os.path.exists(local_path) and os.path.getsize(local_path) > 0:
-        with lock:
-            url_to_local_path[url_decoded] = local_path
-            url_to_local_path[url] = local_path
-        return local_path
+def _scan_media_dir(media_dir):
+    """Return {filename: size} for every file already in media_dir"""
+    existing_files = {}
+    try:
+        with os.scandir(media_dir) as it:
+            for entry in it:
+                if entry.is_file():
+                    existing_files[entry.name] = entry.stat().st_size
+    except FileNotFoundError:
+        pass
+    return existing_files
+
+
+def _remove_partial(local_path):
+    """Delete a partly written download so the next run fetches it again"""
+    try:
+        os.remove(local_path)
+    except FileNotFoundError:
+        pass
+
+
+def download_media(url, local_path):
+    """Download media from URL to local_path and return it (None on failure)
+
+    local_path comes from get_local_path_for_url; checking for an existing
+    file and recording the result in url_to_local_path is left to the caller.
+    """
+    url_decoded = unescape_url(url)
     
     try:
         url_to_fetch = url_decoded
@@ -196,42 +359,35 @@ def download_media(url, media_dir, url_to_local_path, lock):
         
         for attempt in range(max_retries):
             try:
-                if attempt == 0:
-                    headers = {
-                        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
-                        'Accept': 'image/webp,image/*,*/*;q=0.8',
-                        'Referer': 'https://www.reddit.com/',
-                    }
-                else:
-                    headers = {
-                        'User-Agent': 'Mozilla/5.0 (X11; Linux x86_64; rv:120.0) Gecko/20100101 Firefox/120.0',
-                    }
+                # First attempt uses the browser-like SESSION.headers
+                headers = None if attempt == 0 else _FALLBACK_HEADERS
                 
-                response = requests.get(
+                with SESSION.get(
                     url_to_fetch,
                     headers=headers,
                     timeout=15,
                     stream=True,
                     allow_redirects=True
-                )
-                response.raise_for_status()
-                
-                with open(local_path, 'wb') as f:
-                    for chunk in response.iter_content(chunk_size=8192):
-                        if chunk:
-                            f.write(chunk)
+                ) as response:
+                    response.raise_for_status()
+                    
+                    # Copy the raw stream in 1 MiB blocks; still undo any
+                    # Content-Encoding so compressed bodies are saved decoded
+                    response.raw.decode_content = True
+                    with open(local_path, 'wb') as f:
+                        shutil.copyfileobj(response.raw, f, length=1024 * 1024)
+                        size = f.tell()
                 
-                if os.path.exists(local_path) and os.path.getsize(local_path) > 0:
-                    with lock:
-                        url_to_local_path[url_to_fetch] = local_path
-                        url_to_local_path[url] = local_path
+                if size > 0:
                     return local_path
                 else:
-                    if os.path.exists(local_path):
-                        os.remove(local_path)
+                    os.remove(local_path)
                     continue
                     
-            except requests.exceptions.RequestException as e:
+            # Errors while reading the body come straight from urllib3
+            # (response.raw), not wrapped in a RequestException
+            except (requests.exceptions.RequestException, Urllib3HTTPError) as e:
+                _remove_partial(local_path)
                 if attempt < max_retries - 1:
                     time.sleep(0.5)
                     continue
@@ -241,12 +397,91 @@ def download_media(url, media_dir, url_to_local_path, lock):
         return None
         
     except Exception as e:
+        _remove_partial(local_path)
         return None
 
 
+# Bodies up to this size (by Content-Length) are read whole and written with
+# a single executor call instead of one call per chunk
+_SMALL_BODY_BYTES = 4 * 1024 * 1024
+
+
+def _write_file(path, data):
+    """Write data to path in one go and return the number of bytes written"""
+    with open(path, 'wb') as f:
+        return f.write(data)
+
+
+async def _download_one(session, semaphore, url, local_path):
+    """Download a single URL to local_path with aiohttp and return (url, local_path or None)"""
+    url_decoded = unescape_url(url)
+    loop = asyncio.get_running_loop()
+    max_retries = 2
+    
+    try:
+        async with semaphore:
+            for attempt in range(max_retries):
+                headers = _DEFAULT_HEADERS if attempt == 0 else {
+                    k: v for k, v in _FALLBACK_HEADERS.items() if v is not None
+                }
+                try:
+                    async with session.get(url_decoded, headers=headers, allow_redirects=True) as response:
+                        response.raise_for_status()
+                        
+                        # Disk writes run in the default executor so the loop keeps serving sockets
+                        if response.content_length is not None and response.content_length <= _SMALL_BODY_BYTES:
+                            data = await response.read()
+                            size = await loop.run_in_executor(None, _write_file, local_path, data)
+                        else:
+                            f = await loop.run_in_executor(None, open, local_path, 'wb')
+                            try:
+                                async for chunk in response.content.iter_chunked(1024 * 1024):
+                                    await loop.run_in_executor(None, f.write, chunk)
+                                size = f.tell()
+                            finally:
+                                f.close()
+                except (aiohttp.ClientError, asyncio.TimeoutError):
+                    # Don't leave a truncated file for _scan_media_dir to find
+                    _remove_partial(local_path)
+                    if attempt < max_retries - 1:
+                        await asyncio.sleep(0.5)
+                        continue
+                    return url, None
+                
+                if size > 0:
+                    return url, local_path
+                os.remove(local_path)
+        
+        return url, None
+        
+    except Exception as e:
+        _remove_partial(local_path)
+        return url, None
+
+
+async def _download_media_batch_async(url_paths, max_workers, on_result):
+    """Download URLs concurrently on one event loop with a shared keep-alive connection pool"""
+    # Media comes from a handful of hosts, so keep their DNS answers for the whole run
+    connector = aiohttp.TCPConnector(limit=max_workers, limit_per_host=20, keepalive_timeout=60, ttl_dns_cache=300)
+    timeout = aiohttp.ClientTimeout(sock_connect=15, sock_read=15)
+    semaphore = asyncio.Semaphore(max_workers)
+    
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        tasks = [_download_one(session, semaphore, url, local_path)
+                 for url, local_path in url_paths]
+        for task in asyncio.as_completed(tasks):
+            url, local_path = await task
+            on_result(url, local_path)
+
+
 def download_media_batch(urls, media_dir, url_to_local_path, max_workers=50):
-    """Download multiple URLs in parallel"""
-    unique_urls = list(set(urls))
+    """Download multiple URLs in parallel (asyncio + aiohttp if installed, threads otherwise)"""
+    # The raw and HTML-decoded forms of a URL fetch the same file, so
+    # download each file once and give every form its result
+    url_forms = {}
+    for url in set(urls):
+        url_forms.setdefault(unescape_url(url), []).append(url)
+    unique_urls = [forms[0] for forms in url_forms.values()]
     if not unique_urls:
         return {}
     
@@ -254,36 +489,159 @@ def download_media_batch(urls, media_dir, url_to_local_path, max_workers=50):
     
     results = {}
     completed = 0
+    successful = 0
     start_time = time.time()
-    lock = Lock()
-    
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        future_to_url = {executor.submit(download_media, url, media_dir, url_to_local_path, lock): url for url in unique_urls}
+    # One directory listing instead of stat calls per URL
+    existing_files = _scan_media_dir(media_dir)
+    
+    # Workers only return paths; all bookkeeping happens here, on one thread
+    def record_result(url, local_path):
+        nonlocal completed, successful
+        url_decoded = unescape_url(url)
+        for form in url_forms[url_decoded]:
+            results[form] = local_path
+        if local_path:
+            url_to_local_path[url_decoded] = local_path
+            for form in url_forms[url_decoded]:
+                url_to_local_path[form] = local_path
+            successful += 1
+        completed += 1
         
-        for future in as_completed(future_to_url):
-            url = future_to_url[future]
-            try:
-                local_path = future.result()
-                results[url] = local_path
-                completed += 1
-                
-                if completed % 10 == 0 or completed == len(unique_urls):
-                    elapsed = time.time() - start_time
-                    rate = completed / elapsed if elapsed > 0 else 0
-                    print(f"Progress: {completed}/{len(unique_urls)} ({completed/len(unique_urls)*100:.1f}%) - {rate:.1f} files/sec")
-            except Exception as e:
-                results[url] = None
-                completed += 1
+        if completed % 10 == 0 or completed == len(unique_urls):
+            elapsed = time.time() - start_time
+            rate = completed / elapsed if elapsed > 0 else 0
+            print(f"Progress: {completed}/{len(unique_urls)} ({completed/len(unique_urls)*100:.1f}%) - {rate:.1f} files/sec")
+    
+    # Resolve everything that needs no network here, up front: URLs mapped
+    # by an earlier batch, and files already on disk. Workers then only get
+    # (url, local_path) pairs that actually have to be fetched
+    to_fetch = []
+    for url in unique_urls:
+        known_path = url_to_local_path.get(unescape_url(url)) or url_to_local_path.get(url)
+        if known_path:
+            record_result(url, known_path)
+            continue
+        try:
+            local_path = get_local_path_for_url(url, media_dir)
+        except Exception as e:
+            record_result(url, None)
+            continue
+        if existing_files.get(os.path.basename(local_path), 0) > 0:
+            record_result(url, local_path)
+        else:
+            to_fetch.append((url, local_path))
+    
+    if aiohttp is not None:
+        asyncio.run(_download_media_batch_async(to_fetch, max_workers, record_result))
+    else:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            future_to_url = {
+                executor.submit(download_media, url, local_path): url
+                for url, local_path in to_fetch
+            }
+            
+            for future in as_completed(future_to_url):
+                url = future_to_url[future]
+                try:
+                    record_result(url, future.result())
+                except Exception as e:
+                    record_result(url, None)
     
     elapsed = time.time() - start_time
-    successful = sum(1 for v in results.values() if v is not None)
     print(f"✓ Downloaded {successful}/{len(unique_urls)} files in {elapsed:.1f} seconds ({successful/elapsed:.1f} files/sec)" if elapsed > 0 else f"✓ Downloaded {successful}/{len(unique_urls)} files")
     
     return results
 
 
-def replace_urls_in_text(text, url_replacements):
-    """Replace URLs in text with local paths, including giphy links"""
+class _UrlPrefixMatcher:
+    """Pure-Python stand-in for the Aho-Corasick automaton (same iter_long API)
+
+    Every known URL starts with 'http', so only those positions in the text
+    are candidates; at each one the longest known URL found there wins.
+    """
+    
+    def __init__(self, words):
+        # words: {url: (length, local_path)}
+        self._words = words
+        self._lengths = sorted({len(url) for url in words}, reverse=True)
+    
+    def iter_long(self, text):
+        """Yield (end_index, value) for non-overlapping, leftmost-longest matches"""
+        words = self._words
+        text_len = len(text)
+        pos = text.find('http')
+        while pos != -1:
+            for length in self._lengths:
+                if pos + length > text_len:
+                    continue
+                value = words.get(text[pos:pos + length])
+                if value is not None:
+                    yield pos + length - 1, value
+                    pos += length
+                    break
+            else:
+                pos += 1
+            pos = text.find('http', pos)
+
+
+def build_url_matcher(url_replacements):
+    """Build a matcher over all URLs in url_replacements for _replace_with_matcher
+
+    Matches both the original and HTML-decoded form of every URL. Uses an
+    Aho-Corasick automaton when pyahocorasick is installed, otherwise a
+    _UrlPrefixMatcher. Returns None if there is nothing to replace (or, for
+    the fallback, a URL doesn't start with 'http'), in which case
+    replace_urls_in_text falls back to per-URL replacement.
+    """
+    if not url_replacements:
+        return None
+    
+    words = {}
+    for original_url, local_path in url_replacements.items():
+        if not local_path:
+            continue
+        words[original_url] = (len(original_url), local_path)
+        decoded_url = unescape_url(original_url)
+        if decoded_url != original_url:
+            words[decoded_url] = (len(decoded_url), local_path)
+    
+    if not words:
+        return None
+    
+    if ahocorasick is None:
+        if not all(url.startswith('http') for url in words):
+            return None
+        return _UrlPrefixMatcher(words)
+    
+    automaton = ahocorasick.Automaton()
+    for url, value in words.items():
+        automaton.add_word(url, value)
+    automaton.make_automaton()
+    return automaton
+
+
+def _replace_with_matcher(text, url_matcher):
+    """Replace all matched URLs in a single pass over text (longest match wins)"""
+    parts = []
+    last_end = 0
+    for end_index, (length, local_path) in url_matcher.iter_long(text):
+        start = end_index - length + 1
+        parts.append(text[last_end:start])
+        parts.append(local_path)
+        last_end = end_index + 1
+    
+    if not parts:
+        return text
+    parts.append(text[last_end:])
+    return ''.join(parts)
+
+
+def replace_urls_in_text(text, url_replacements, url_matcher=None):
+    """Replace URLs in text with local paths, including giphy links
+
+    If url_matcher (from build_url_matcher) is given, URLs are replaced in
+    one pass over the text instead of one scan per known URL.
+    """
     if not text or not url_replacements:
         return text
     
@@ -292,7 +650,6 @@ def replace_urls_in_text(text, url_replacements):
     # First, replace giphy|ID patterns with local paths if they were downloaded
     # Check if any giphy URLs were downloaded
     # Pattern matches: ![gif](giphy|ID) or [gif](giphy|ID) or just giphy|ID
-    giphy_pattern = r'(!?\[[^\]]*\]\()?giphy\|([A-Za-z0-9]+)(\))?'
     def replace_giphy_with_local(match):
         giphy_id = match.group(2)
         # Check if this giphy was downloaded
@@ -310,22 +667,39 @@ def replace_urls_in_text(text, url_replacements):
         # If not downloaded, keep the original pattern (it will be handled by embed_media_in_text)
         return match.group(0)
     
-    text = re.sub(giphy_pattern, replace_giphy_with_local, text, flags=re.IGNORECASE)
+    # Every giphy|ID has a '|' (a literal that works for any case of "giphy")
+    if '|' in text:
+        text = _GIPHY_REPLACE_RE.sub(replace_giphy_with_local, text)
     
     if 'http' not in text:
         return text
     
+    if url_matcher is not None:
+        return _replace_with_matcher(text, url_matcher)
+    
     for original_url, local_path in url_replacements.items():
         if local_path and original_url in text:
             text = text.replace(original_url, local_path)
         
-        decoded_url = html_lib.unescape(original_url)
+        decoded_url = unescape_url(original_url)
         if decoded_url != original_url and decoded_url in text:
             text = text.replace(decoded_url, local_path)
     
     return text
 
 
+# Compiled local-media-path patterns, keyed by media directory name
+_EMBED_RE_CACHE = {}
+
+
+def _giphy_img_tag(match):
+    """_GIPHY_RE.sub() callback: embed the giphy as a remote img tag"""
+    giphy_id = match.group(1)
+    # Use the direct URL (if it wasn't downloaded, this is the fallback)
+    giphy_url = f'https://media.giphy.com/media/{giphy_id}/giphy.gif'
+    return f'<img src="{giphy_url}" style="max-width: 100%; height: auto; margin: 10px 0; border-radius: 4px;" alt="GIF" />'
+
+
 def embed_media_in_text(text, media_dir='downloaded_media'):
     """Convert local media file paths in text to HTML img/video tags, and handle giphy links"""
     if not text:
@@ -336,24 +710,29 @@ def embed_media_in_text(text, media_dir='downloaded_media'):
     # Convert remaining giphy links to image tags (if not already replaced with local paths)
     # Pattern: ![gif](giphy|ID) or [gif](giphy|ID) or just giphy|ID
     # Note: If giphy was downloaded, replace_urls_in_text should have already replaced it with a local path
-    giphy_pattern = r'(?:!?\[[^\]]*\]\()?giphy\|([A-Za-z0-9]+)\)?'
-    def replace_giphy(match):
-        giphy_id = match.group(1)
-        # Use the direct URL (if it wasn't downloaded, this is the fallback)
-        giphy_url = f'https://media.giphy.com/media/{giphy_id}/giphy.gif'
-        return f'<img src="{giphy_url}" style="max-width: 100%; height: auto; margin: 10px 0; border-radius: 4px;" alt="GIF" />'
-    
-    text = re.sub(giphy_pattern, replace_giphy, text, flags=re.IGNORECASE)
+    # Every giphy|ID has a '|', so bodies without one skip the scan
+    if '|' in text:
+        text = _GIPHY_RE.sub(_giphy_img_tag, text)
     
     # Extract just the directory name (not full path) for pattern matching
     # Paths in text are relative like "downloaded_media/filename.jpg"
     # But media_dir might be a full path like "output/downloaded_media"
     media_dir_name = os.path.basename(str(media_dir))
     
+    # Most bodies contain no local media paths at all
+    if media_dir_name not in text:
+        return text
+    
     # Pattern to match local media paths - match paths that start with the directory name
     # This will match paths like "downloaded_media/filename.jpg" 
     # Also match standalone filenames if they're in the media directory
-    media_pattern = rf'{re.escape(media_dir_name)}/[^\s<>")\]]+\.(jpg|jpeg|png|gif|webp|svg|bmp|ico|mp4|webm|avi|mov|wmv|flv|m4v|mpg|mpeg)'
+    media_pattern = _EMBED_RE_CACHE.get(media_dir_name)
+    if media_pattern is None:
+        media_pattern = re.compile(
+            rf'{re.escape(media_dir_name)}/[^\s<>")\]]+\.(jpg|jpeg|png|gif|webp|svg|bmp|ico|mp4|webm|avi|mov|wmv|flv|m4v|mpg|mpeg)',
+            re.IGNORECASE
+        )
+        _EMBED_RE_CACHE[media_dir_name] = media_pattern
     
     def replace_media_path(match):
         media_path = match.group(0)  # Get the full matched path
@@ -372,50 +751,82 @@ def embed_media_in_text(text, media_dir='downloaded_media'):
             return media_path
     
     # Replace media paths with HTML tags
-    text = re.sub(media_pattern, replace_media_path, text, flags=re.IGNORECASE)
+    text = media_pattern.sub(replace_media_path, text)
     
     return text
 
 
-def parse_reddit_comment(comment_data, url_replacements=None, media_dir='downloaded_media'):
-    """Parse a Reddit comment (kind='t1') and extract its data"""
+def _intern(value):
+    """Intern short strings that repeat across many posts/comments (authors, subreddits)"""
+    return sys.intern(value) if type(value) is str else value
+
+
+def parse_reddit_comment(comment_data):
+    """Parse a Reddit comment (kind='t1') and its replies
+
+    Bodies are kept raw; embed_media_in_comment_tree rewrites media once the
+    comment trees from all listings have been merged. Replies are walked
+    with an explicit stack instead of recursion so that very deep threads
+    can't hit Python's recursion limit.
+    """
     if comment_data.get('kind') != 't1':
         return None
     
-    data = comment_data.get('data', {})
-    comment_id = data.get('name', '')
-    author = data.get('author', '[deleted]')
-    body = data.get('body', '')
-    score = data.get('score', 0)
-    created_utc = data.get('created_utc', 0)
-    
-    # Replace URLs in body text
-    if url_replacements:
-        body = replace_urls_in_text(body, url_replacements)
+    root = []
+    # Each entry is (comment item, replies list its parsed dict goes into)
+    stack = [(comment_data, root)]
     
-    # Embed media (convert local paths to HTML img/video tags)
-    body = embed_media_in_text(body, media_dir)
-    
-    # Parse replies recursively
-    replies = []
-    if 'replies' in data and data['replies']:
-        if isinstance(data['replies'], dict) and data['replies'].get('kind') == 'Listing':
-            for reply_item in data['replies']['data'].get('children', []):
-                # Skip "more" comments
-                if reply_item.get('kind') == 'more':
-                    continue
-                reply = parse_reddit_comment(reply_item, url_replacements, media_dir)
-                if reply:
-                    replies.append(reply)
+    while stack:
+        item, parent_replies = stack.pop()
+        
+        data = item.get('data', {})
+        comment_id = data.get('name', '')
+        author = _intern(data.get('author', '[deleted]'))
+        body = data.get('body', '')
+        score = data.get('score', 0)
+        created_utc = data.get('created_utc', 0)
+        
+        replies = []
+        parent_replies.append({
+            'id': comment_id,
+            'author': author,
+            'body': body,
+            'score': score,
+            'createdAt': created_utc,
+            'replies': replies
+        })
+        
+        if 'replies' in data and data['replies']:
+            if isinstance(data['replies'], dict) and data['replies'].get('kind') == 'Listing':
+                # Push in reverse so replies are popped (and appended) in their original order
+                for reply_item in reversed(data['replies']['data'].get('children', [])):
+                    # Skip "more" comments and anything else that isn't a comment
+                    if reply_item.get('kind') != 't1':
+                        continue
+                    stack.append((reply_item, replies))
     
-    return {
-        'id': comment_id,
-        'author': author,
-        'body': body,
-        'score': score,
-        'createdAt': created_utc,
-        'replies': replies
-    }
+    return root[0]
+
+
+def embed_media_in_comment_tree(comment_tree, url_replacements=None, media_dir='downloaded_media', url_matcher=None):
+    """Replace media URLs and embed local media in every comment body, in place
+
+    Run once on the final (merged) tree so each body is processed exactly
+    once, however many listings it appeared in.
+    """
+    stack = list(comment_tree.values())
+    while stack:
+        comment = stack.pop()
+        body = comment['body']
+        
+        # Replace URLs in body text
+        if url_replacements:
+            body = replace_urls_in_text(body, url_replacements, url_matcher)
+        
+        # Embed media (convert local paths to HTML img/video tags)
+        comment['body'] = embed_media_in_text(body, media_dir)
+        
+        stack.extend(comment['replies'])
 
 
 def merge_comment_replies(replies1, replies2):
@@ -469,8 +880,26 @@ def merge_comment_trees(tree1, tree2):
     return merged
 
 
-def parse_reddit_post(post_item, comments_listing, url_replacements=None, media_dir='downloaded_media'):
-    """Parse a Reddit post and its associated comments"""
+def build_comment_tree(comments_listing):
+    """Build a {comment_id: comment} tree from a comments listing (bodies left raw)"""
+    comment_tree = {}
+    if comments_listing and comments_listing.get('kind') == 'Listing':
+        for comment_item in comments_listing['data'].get('children', []):
+            # Skip "more" comments
+            if comment_item.get('kind') == 'more':
+                continue
+            comment = parse_reddit_comment(comment_item)
+            if comment:
+                comment_tree[comment['id']] = comment
+    return comment_tree
+
+
+def parse_reddit_post(post_item, comments_listing, url_replacements=None, media_dir='downloaded_media', url_matcher=None):
+    """Parse a Reddit post and its associated comments
+
+    Media in the post body is replaced/embedded here; comment bodies are
+    left raw for embed_media_in_comment_tree.
+    """
     if post_item.get('kind') != 't3':
         return None
     
@@ -478,10 +907,10 @@ def parse_reddit_post(post_item, comments_listing, url_replacements=None, media_
     post_id = data.get('name', '')
     title = data.get('title', 'Untitled')
     selftext = data.get('selftext', '')
-    author = data.get('author', '[deleted]')
+    author = _intern(data.get('author', '[deleted]'))
     score = data.get('score', 0)
     created_utc = data.get('created_utc', 0)
-    subreddit = data.get('subreddit', '')
+    subreddit = _intern(data.get('subreddit', ''))
     
     # Collect media URLs from post metadata (preview, thumbnail, etc.)
     # These should be embedded even if not in selftext
@@ -491,7 +920,7 @@ def parse_reddit_post(post_item, comments_listing, url_replacements=None, media_
     if 'thumbnail' in data and url_replacements:
         thumb_url = data.get('thumbnail')
         if thumb_url:
-            thumb_url_decoded = html_lib.unescape(thumb_url)
+            thumb_url_decoded = unescape_url(thumb_url)
             if thumb_url_decoded in url_replacements:
                 local_thumb = url_replacements[thumb_url_decoded]
                 if local_thumb and local_thumb not in selftext:
@@ -508,7 +937,7 @@ def parse_reddit_post(post_item, comments_listing, url_replacements=None, media_
             if isinstance(img, dict) and 'source' in img:
                 src_url = img['source'].get('url')
                 if src_url:
-                    src_url = html_lib.unescape(src_url)
+                    src_url = unescape_url(src_url)
                     if src_url in url_replacements:
                         local_img = url_replacements[src_url]
                         if local_img and local_img not in selftext:
@@ -516,7 +945,7 @@ def parse_reddit_post(post_item, comments_listing, url_replacements=None, media_
     
     # Replace URLs in body text
     if url_replacements:
-        selftext = replace_urls_in_text(selftext, url_replacements)
+        selftext = replace_urls_in_text(selftext, url_replacements, url_matcher)
     
     # Embed media (convert local paths to HTML img/video tags)
     selftext = embed_media_in_text(selftext, media_dir)
@@ -531,17 +960,6 @@ def parse_reddit_post(post_item, comments_listing, url_replacements=None, media_
                 if embedded != media_path:  # Was converted to img tag
                     selftext = embedded + '\n\n' + selftext if selftext else embedded
     
-    # Build comment tree from comments listing
-    comment_tree = {}
-    if comments_listing and comments_listing.get('kind') == 'Listing':
-        for comment_item in comments_listing['data'].get('children', []):
-            # Skip "more" comments
-            if comment_item.get('kind') == 'more':
-                continue
-            comment = parse_reddit_comment(comment_item, url_replacements, media_dir)
-            if comment:
-                comment_tree[comment['id']] = comment
-    
     return {
         'id': post_id,
         'title': title,
@@ -550,17 +968,30 @@ def parse_reddit_post(post_item, comments_listing, url_replacements=None, media_
         'score': score,
         'createdAt': created_utc,
         'subreddit': subreddit,
-        'comment_tree': comment_tree
+        'comment_tree': build_comment_tree(comments_listing)
     }
 
 
-def format_timestamp(timestamp):
-    """Format Unix timestamp to relative time"""
+def count_all_comments(tree):
+    """Count every comment in a comment tree, including nested replies at any depth"""
+    total = 0
+    stack = list(tree.values())
+    while stack:
+        comment = stack.pop()
+        total += 1
+        stack.extend(comment.get('replies', ()))
+    return total
+
+
+def format_timestamp(timestamp, now_utc=None):
+    """Format Unix timestamp to relative time
+
+    Pass now_utc when formatting many timestamps so the clock is read once.
+    """
     if not timestamp:
         return ""
     try:
-        from datetime import datetime, timezone
-        now = datetime.now(timezone.utc)
+        now = now_utc or datetime.now(timezone.utc)
         post_time = datetime.fromtimestamp(timestamp, tz=timezone.utc)
         diff = now - post_time
         
@@ -577,71 +1008,103 @@ def format_timestamp(timestamp):
             return f"{minutes}m ago"
         else:
             return "just now"
-    except:
+    except (TypeError, ValueError, OverflowError, OSError):
         return ""
 
 
-def comment_to_html(comment, depth=0):
-    """Convert comment dictionary to HTML in Reddit style"""
-    author = comment.get('author', '[deleted]')
-    score = comment.get('score', 0)
-    body = comment.get('body', '')
-    created_at = comment.get('createdAt', 0)
-    comment_id = comment.get('id', '')
-    
-    # Format author
-    if author == '[deleted]':
-        author_html = '<span class="deleted-author">[deleted]</span>'
-    else:
-        author_html = f'<a href="#" class="comment-author">u/{html_lib.escape(author)}</a>'
-    
-    # Format score with color
-    score_class = "positive" if score > 0 else "negative" if score < 0 else ""
-    score_display = f"{score:+d}" if score != 0 else "0"
-    
-    # Format timestamp
-    time_str = format_timestamp(created_at)
-    
-    # If body contains HTML tags (from embedded media), use as-is, otherwise escape
-    if '<img' in body or '<video' in body:
-        body_html = body
-    else:
-        body_html = html_lib.escape(body)
-    
-    # Build comment HTML
-    if depth == 0:
-        html_str = f'''<div class="comment">
+# Tags that embed_media_in_text inserts into bodies
+_EMBED_TAG_RE = re.compile(r'<(?:img|video)')
+
+
+def body_to_html(body):
+    """Return body as HTML: as-is if it has embedded media tags, otherwise escaped"""
+    # One regex scan instead of separate '<img' / '<video' substring checks
+    if _EMBED_TAG_RE.search(body):
+        return body
+    return html_lib.escape(body)
+
+
+def comment_to_html(comment, depth=0, out=None, now_utc=None):
+    """Convert comment dictionary to HTML in Reddit style
+
+    HTML fragments are appended to out; if no list is passed in, the
+    joined HTML string is returned instead. The reply tree is walked with
+    an explicit stack, so deep threads don't recurse.
+    """
+    if out is None:
+        out = []
+        comment_to_html(comment, depth, out, now_utc)
+        return ''.join(out)
+    
+    # Entries are (comment, depth) to render, or a string of closing tags
+    # to emit once all of a comment's replies have been rendered
+    stack = [(comment, depth)]
+    
+    while stack:
+        entry = stack.pop()
+        if isinstance(entry, str):
+            out.append(entry)
+            continue
+        
+        comment, depth = entry
+        author = comment.get('author', '[deleted]')
+        score = comment.get('score', 0)
+        body = comment.get('body', '')
+        created_at = comment.get('createdAt', 0)
+        comment_id = comment.get('id', '')
+        
+        # Format author
+        if author == '[deleted]':
+            author_html = '<span class="deleted-author">[deleted]</span>'
+        else:
+            author_html = f'<a href="#" class="comment-author">u/{html_lib.escape(author)}</a>'
+        
+        # Format score with color
+        score_class = "positive" if score > 0 else "negative" if score < 0 else ""
+        score_display = f"{score:+d}" if score != 0 else "0"
+        
+        # Format timestamp
+        time_str = format_timestamp(created_at, now_utc)
+        
+        body_html = body_to_html(body)
+        
+        # Build comment HTML
+        if depth == 0:
+            out.append(f'''<div class="comment">
             <div class="comment-header">
                 {author_html}
                 <span class="comment-score {score_class}">{score_display} points</span>
                 <span class="comment-time">{time_str}</span>
             </div>
-            <div class="comment-body">{body_html}</div>'''
-    else:
-        html_str = f'''<div class="comment-thread">
+            <div class="comment-body">{body_html}</div>''')
+            stack.append("</div>")
+        else:
+            out.append(f'''<div class="comment-thread">
             <div class="comment">
                 <div class="comment-header">
                     {author_html}
                     <span class="comment-score {score_class}">{score_display} points</span>
                     <span class="comment-time">{time_str}</span>
                 </div>
-                <div class="comment-body">{body_html}</div>'''
-    
-    # Process replies recursively
-    for reply in comment.get('replies', []):
-        html_str += comment_to_html(reply, depth + 1)
-    
-    if depth == 0:
-        html_str += "</div>"
-    else:
-        html_str += "</div></div>"
-    
-    return html_str
+                <div class="comment-body">{body_html}</div>''')
+            stack.append("</div></div>")
+        
+        # Replies go on top of the closing tags, reversed to keep their order
+        for reply in reversed(comment.get('replies', [])):
+            stack.append((reply, depth + 1))
+
+
+# Below this many posts, process pool startup and pickling cost more than
+# the parallel work saves
+_PARALLEL_MIN_POSTS = 64
 
 
 def generate_html(posts, url_to_local_path, output_file='media_aware_visualization.html'):
     """Generate HTML visualization from posts dictionary"""
-    html_content = f"""<!DOCTYPE html>
+    # Relative times are computed against one shared "now"
+    now_utc = datetime.now(timezone.utc)
+    
+    header = f"""<!DOCTYPE html>
 <html>
 <head>
     <title>Reddit Conversation Visualizer</title>
@@ -836,8 +1299,48 @@ def generate_html(posts, url_to_local_path, output_file='media_aware_visualizati
         <div class="post-list">
 
 """
+    footer = """
+        </div>
+    </div>
+</body>
+</html>
+"""
+    
+    workers = os.cpu_count() or 1
+    
+    # Stream UTF-8 bytes through a 1 MiB buffer, so the whole page never
+    # has to exist as a single string in memory
+    with open(output_file, 'wb', buffering=1024 * 1024) as f:
+        f.write(header.encode('utf-8'))
+        if len(posts) >= _PARALLEL_MIN_POSTS and workers > 1:
+            # Posts render independently, so spread them over worker
+            # processes and write the chunks back in their original order
+            post_items = list(posts.items())
+            chunk_size = -(-len(post_items) // (workers * 4))
+            chunks = [post_items[i:i + chunk_size] for i in range(0, len(post_items), chunk_size)]
+            # Let the executor size the pool: an explicit os.cpu_count() is
+            # rejected on Windows machines with more than 61 CPUs
+            with ProcessPoolExecutor() as executor:
+                for html_bytes in executor.map(_render_posts_chunk, chunks, itertools.repeat(now_utc)):
+                    f.write(html_bytes)
+        else:
+            for parts in _iter_post_html(posts.items(), now_utc):
+                f.writelines(part.encode('utf-8') for part in parts)
+        f.write(footer.encode('utf-8'))
     
-    for post_id, post in posts.items():
+    print(f"✓ HTML visualization saved to {output_file}")
+
+
+def _render_posts_chunk(post_items, now_utc):
+    """Render (post_id, post) pairs to UTF-8 HTML bytes (ProcessPoolExecutor worker)"""
+    return ''.join(
+        part for parts in _iter_post_html(post_items, now_utc) for part in parts
+    ).encode('utf-8')
+
+
+def _iter_post_html(post_items, now_utc):
+    """Yield the list of HTML fragments for each (post_id, post) pair, one post at a time"""
+    for post_id, post in post_items:
         title = html_lib.escape(post.get('title', 'Untitled'))
         body = post.get('body', '')  # Already processed with URL replacements and media embedding
         comment_tree = post.get('comment_tree', {})
@@ -845,25 +1348,13 @@ def generate_html(posts, url_to_local_path, output_file='media_aware_visualizati
         score = post.get('score', 0)
         subreddit = html_lib.escape(post.get('subreddit', ''))
         created_at = post.get('createdAt', 0)
-        time_str = format_timestamp(created_at)
-        
-        # If body contains HTML tags (from embedded media), use as-is, otherwise escape
-        if '<img' in body or '<video' in body:
-            body_html = body
-        else:
-            body_html = html_lib.escape(body)
+        time_str = format_timestamp(created_at, now_utc)
         
-        # Count comments
-        def count_all_comments(tree):
-            count = len(tree)
-            for comment in tree.values():
-                if comment.get('replies'):
-                    count += len(comment['replies'])
-            return count
+        body_html = body_to_html(body)
         
         comment_count = count_all_comments(comment_tree)
         
-        html_content += f"""            <div class="post">
+        parts = [f"""            <div class="post">
                 <div class="post-header">
                     <div class="post-header-left">
                         <div class="post-title">{title}</div>
@@ -884,96 +1375,188 @@ def generate_html(posts, url_to_local_path, output_file='media_aware_visualizati
                     {body_html}
                 </div>
                 <div class="comments-section" id="comments-{post_id}">
-"""
+"""]
         for comment_id, comment in comment_tree.items():
-            html_content += comment_to_html(comment, 0)
+            comment_to_html(comment, 0, parts, now_utc)
         
-        html_content += "</div></div>"
-    
-    html_content += """
-        </div>
-    </div>
-</body>
-</html>
-"""
-    
-    with open(output_file, 'w', encoding='utf-8') as f:
-        f.write(html_content)
-    
-    print(f"✓ HTML visualization saved to {output_file}")
+        parts.append("</div></div>")
+        yield parts
+
+
+# Patterns used by clean_text_for_training. _HTML_TAG_RE matches an img tag
+# with a src (its path is group 1), an img tag without one (group 2), a whole
+# video element (group 3) or any other tag; a generic tag can't contain '<',
+# so a stray "<3" in the text doesn't swallow a following media tag
+_HTML_TAG_RE = re.compile(
+    r'<img[^>]*?src=["\']([^"\'>]+)["\'][^>]*>|(<img[^>]*>)|(<video[^>]*>.*?</video>)|<[^<>]+>',
+    re.DOTALL
+)
+_SOURCE_SRC_RE = re.compile(r'<source[^>]+src=["\']([^"\']+)["\']')
+_MEDIA_PATH_RE = re.compile(
+    r'[^\s<>")\]]+\.(jpg|jpeg|png|gif|webp|svg|bmp|ico|mp4|webm|avi|mov|wmv|flv|m4v|mpg|mpeg)',
+    re.IGNORECASE
+)
+
+# The entities Reddit's escaping actually produces. '&amp;' is decoded last
+# so that "&amp;lt;" comes out as "&lt;", as it does with html.unescape()
+_COMMON_ENTITIES = (('&lt;', '<'), ('&gt;', '>'), ('&quot;', '"'), ('&#39;', "'"), ('&amp;', '&'))
+
+
+def _unescape(text):
+    """Decode HTML entities, same result as html.unescape().
+    
+    When every '&' in the text starts one of _COMMON_ENTITIES, a few
+    str.replace() calls do the job without the regex callback per entity.
+    """
+    if text.count('&') != sum(text.count(entity) for entity, _ in _COMMON_ENTITIES):
+        return html_lib.unescape(text)
+    for entity, char in _COMMON_ENTITIES:
+        text = text.replace(entity, char)
+    return text
+
+
+def _relative_media_path(path, output_dir):
+    """Make an absolute media path relative to output_dir, if one is given"""
+    if output_dir and os.path.isabs(path):
+        try:
+            return os.path.relpath(path, output_dir)
+        except ValueError:
+            pass  # e.g. a different drive on Windows; keep the original path
+    return path
+
+
+@functools.lru_cache(maxsize=None)
+def _media_tag_replacer(output_dir):
+    """Build the _HTML_TAG_RE.sub() callback for one output_dir (or None)
+    
+    img/video tags become their src path, other tags are dropped.
+    """
+    def replace_tag(match):
+        if match.group(1) is not None:
+            return _relative_media_path(match.group(1), output_dir)
+        if match.group(2) is not None:
+            return '[image]'
+        if match.group(3) is not None:
+            src_match = _SOURCE_SRC_RE.search(match.group(3))
+            if src_match:
+                return _relative_media_path(src_match.group(1), output_dir)
+            return '[video]'
+        return ''
+    return replace_tag
 
 
 def clean_text_for_training(text, preserve_media_paths=True, output_dir=None):
     """Remove HTML tags from text, optionally preserving local media paths for training"""
     if not text:
         return ""
-    
-    import re
-    # Extract image paths from img tags and replace with just the path
-    def replace_img_tag(match):
-        img_tag = match.group(0)
-        # Extract src attribute
-        src_match = re.search(r'src=["\']([^"\']+)["\']', img_tag)
-        if src_match:
-            path = src_match.group(1)
-            # Normalize path relative to output directory if provided
-            if output_dir and preserve_media_paths:
-                try:
-                    # If path is absolute or relative, make it relative to output_dir
-                    path_obj = Path(path)
-                    if path_obj.is_absolute():
-                        path = os.path.relpath(path, output_dir)
-                    # If it's already relative, keep it as-is (should be relative to output_dir already)
-                except:
-                    pass  # Keep original path if normalization fails
-            return path
-        return '[image]'
-    
-    # Extract video paths from video tags
-    def replace_video_tag(match):
-        video_tag = match.group(0)
-        # Extract src from source tag
-        src_match = re.search(r'<source[^>]+src=["\']([^"\']+)["\']', video_tag)
-        if src_match:
-            path = src_match.group(1)
-            # Normalize path relative to output directory if provided
-            if output_dir and preserve_media_paths:
-                try:
-                    path_obj = Path(path)
-                    if path_obj.is_absolute():
-                        path = os.path.relpath(path, output_dir)
-                except:
-                    pass
-            return path
-        return '[video]'
-    
-    # Replace img tags with their src paths
-    text = re.sub(r'<img[^>]*>', replace_img_tag, text)
-    # Replace video tags with their src paths
-    text = re.sub(r'<video[^>]*>.*?</video>', replace_video_tag, text, flags=re.DOTALL)
-    # Remove any remaining HTML tags
-    text = re.sub(r'<[^>]+>', '', text)
+    return _clean_text_cached(text, preserve_media_paths, os.fspath(output_dir) if output_dir else None)
+
+
+def _clean_text_impl(text, preserve_media_paths, output_dir):
+    """clean_text_for_training() for a non-empty text and str output_dir"""
+    # Plain-text bodies (the common case) have no tags to strip
+    if '<' in text:
+        # Replace img/video tags with their src paths and remove any other
+        # HTML tags, all in a single pass
+        text = _HTML_TAG_RE.sub(_media_tag_replacer(output_dir if preserve_media_paths else None), text)
     # Decode HTML entities
-    text = html_lib.unescape(text)
+    if '&' in text:
+        text = _unescape(text)
     
-    # If preserve_media_paths is False, replace paths with placeholders
-    if not preserve_media_paths:
+    # If preserve_media_paths is False, replace paths with placeholders.
+    # Every match has a '.' before its extension, so text without one can
+    # skip the regex
+    if not preserve_media_paths and '.' in text:
         # Replace local file paths with placeholders
-        text = re.sub(r'[^\s<>")\]]+\.(jpg|jpeg|png|gif|webp|svg|bmp|ico|mp4|webm|avi|mov|wmv|flv|m4v|mpg|mpeg)', '[media]', text, flags=re.IGNORECASE)
+        text = _MEDIA_PATH_RE.sub('[media]', text)
     
     return text.strip()
 
 
+# Merged dumps repeat the same titles and comment bodies, so remember the
+# cleaned form of recent inputs in the serial export
+_clean_text_cached = functools.lru_cache(maxsize=200_000)(_clean_text_impl)
+
+# Export workers each get their own copy of the cache and only see the
+# chunks they're handed, so repeats rarely hit there; keep it small so the
+# memory doesn't multiply by the pool size
+_WORKER_CLEAN_CACHE_SIZE = 1024
+
+
+def _init_export_worker():
+    """ProcessPoolExecutor initializer: swap in a small per-worker clean cache"""
+    global _clean_text_cached
+    _clean_text_cached = functools.lru_cache(maxsize=_WORKER_CLEAN_CACHE_SIZE)(_clean_text_impl)
+
+
 def comment_to_dict(comment, preserve_media_paths=True, output_dir=None):
-    """Convert comment object to dictionary for JSONL export"""
-    return {
-        'id': comment.get('id', ''),
-        'author': comment.get('author', '[deleted]'),
-        'body': clean_text_for_training(comment.get('body', ''), preserve_media_paths=preserve_media_paths, output_dir=output_dir),
-        'score': comment.get('score', 0),
-        'created_at': comment.get('createdAt', 0),
-        'replies': [comment_to_dict(reply, preserve_media_paths=preserve_media_paths, output_dir=output_dir) for reply in comment.get('replies', [])]
-    }
+    """Convert comment object to dictionary for JSONL export
+
+    Walks the reply tree with an explicit stack, like parse_reddit_comment,
+    so deep threads don't recurse. output_dir is converted to a str once
+    here and each body goes straight to _clean_text_cached, rather than
+    through clean_text_for_training for every comment in the thread.
+    """
+    output_dir = os.fspath(output_dir) if output_dir else None
+    root = []
+    # Each entry is (comment, list its exported dict goes into)
+    stack = [(comment, root)]
+    
+    while stack:
+        comment, parent_replies = stack.pop()
+        replies = []
+        body = comment.get('body', '')
+        parent_replies.append({
+            'id': comment.get('id', ''),
+            'author': comment.get('author', '[deleted]'),
+            'body': _clean_text_cached(body, preserve_media_paths, output_dir) if body else "",
+            'score': comment.get('score', 0),
+            'created_at': comment.get('createdAt', 0),
+            'replies': replies
+        })
+        # Push in reverse so replies keep their original order
+        for reply in reversed(comment.get('replies', [])):
+            stack.append((reply, replies))
+    
+    return root[0]
+
+
+def _post_to_jsonl_line(args):
+    """Clean and encode one (post_id, post, preserve_media_paths, output_dir) tuple.
+    
+    Returns the UTF-8 JSONL line, or None if the post could not be exported.
+    Runs in ProcessPoolExecutor workers for large exports.
+    """
+    post_id, post, preserve_media_paths, output_dir = args
+    try:
+        comment_tree = post.get('comment_tree', {})
+        
+        # Convert comment tree to list
+        comments_list = []
+        for comment_id, comment in comment_tree.items():
+            try:
+                comments_list.append(comment_to_dict(comment, preserve_media_paths=preserve_media_paths, output_dir=output_dir))
+            except Exception as e:
+                print(f"  Warning: Failed to process comment {comment_id}: {e}")
+                continue
+        
+        post_data = {
+            'id': post.get('id', ''),
+            'title': clean_text_for_training(post.get('title', ''), preserve_media_paths=preserve_media_paths),
+            'author': post.get('author', '[deleted]'),
+            'body': clean_text_for_training(post.get('body', ''), preserve_media_paths=preserve_media_paths, output_dir=output_dir),
+            'score': post.get('score', 0),
+            'created_at': post.get('createdAt', 0),
+            'subreddit': post.get('subreddit', ''),
+            'comment_count': len(comments_list),
+            'comments': comments_list
+        }
+        
+        return json_dumps(post_data) + b'\n'
+        
+    except Exception as e:
+        print(f"  Warning: Failed to export post {post_id}: {e}")
+        return None
 
 
 def export_to_jsonl(posts, output_file='conversation_data_cleaned.jsonl', preserve_media_paths=True, output_dir=None):
@@ -985,43 +1568,28 @@ def export_to_jsonl(posts, output_file='conversation_data_cleaned.jsonl', preser
     # Get output directory for path normalization
     if output_dir is None:
         output_dir = os.path.dirname(output_file) or '.'
-    output_dir = Path(output_dir).resolve()
+    output_dir = str(Path(output_dir).resolve())
     
     try:
         exported_count = 0
+        workers = os.cpu_count() or 1
+        items = ((post_id, post, preserve_media_paths, output_dir) for post_id, post in posts.items())
         
-        with open(output_file, 'w', encoding='utf-8') as f:
-            for post_id, post in posts.items():
-                try:
-                    comment_tree = post.get('comment_tree', {})
-                    
-                    # Convert comment tree to list
-                    comments_list = []
-                    for comment_id, comment in comment_tree.items():
-                        try:
-                            comments_list.append(comment_to_dict(comment, preserve_media_paths=preserve_media_paths, output_dir=output_dir))
-                        except Exception as e:
-                            print(f"  Warning: Failed to process comment {comment_id}: {e}")
-                            continue
-                    
-                    post_data = {
-                        'id': post.get('id', ''),
-                        'title': clean_text_for_training(post.get('title', ''), preserve_media_paths=preserve_media_paths),
-                        'author': post.get('author', '[deleted]'),
-                        'body': clean_text_for_training(post.get('body', ''), preserve_media_paths=preserve_media_paths, output_dir=output_dir),
-                        'score': post.get('score', 0),
-                        'created_at': post.get('createdAt', 0),
-                        'subreddit': post.get('subreddit', ''),
-                        'comment_count': len(comments_list),
-                        'comments': comments_list
-                    }
-                    
-                    f.write(json.dumps(post_data, ensure_ascii=False) + '\n')
-                    exported_count += 1
-                    
-                except Exception as e:
-                    print(f"  Warning: Failed to export post {post_id}: {e}")
-                    continue
+        with open(output_file, 'wb', buffering=1024 * 1024) as f:
+            if len(posts) >= _PARALLEL_MIN_POSTS and workers > 1:
+                # Posts clean independently; map() keeps the original order.
+                # The executor picks the pool size (see generate_html)
+                with ProcessPoolExecutor(initializer=_init_export_worker) as executor:
+                    lines = executor.map(_post_to_jsonl_line, items, chunksize=32)
+                    for line in lines:
+                        if line is not None:
+                            f.write(line)
+                            exported_count += 1
+            else:
+                for line in map(_post_to_jsonl_line, items):
+                    if line is not None:
+                        f.write(line)
+                        exported_count += 1
         
         print(f"✓ JSONL export saved to {output_file}")
         print(f"  - {exported_count} posts exported")
@@ -1036,74 +1604,81 @@ def load_jsonl_file(input_file, posts_data, all_media_urls):
     """Load a single JSONL file and extract posts/comments"""
     print(f"Reading Reddit JSONL data from {input_file}...")
     
-    with open(input_file, 'r', encoding='utf-8') as f:
+    # Binary mode: both parsers take UTF-8 bytes, skipping a str decode per
+    # line. The trailing newline is JSON whitespace, so lines (which can be
+    # tens of MB) aren't copied just to strip it
+    with open(input_file, 'rb') as f:
         for line_num, line in enumerate(f, 1):
+            # Media URLs found on this line, added to the set in one go
+            line_urls = []
             try:
-                data = json.loads(line.strip())
+                data = json_loads(line)
                 
-                # Reddit API format: [Listing (posts), Listing (comments)]
-                if not isinstance(data, list) or len(data) < 1:
-                    print(f"  Warning: Line {line_num} is not in expected Reddit API format")
-                    continue
+                # Reddit API format: [Listing (posts), Listing (comments)].
+                # Nearly every line has that shape, so index straight in and
+                # only validate step by step when that fails
+                try:
+                    posts_listing = data[0]
+                    post_children = posts_listing['data']['children'] if posts_listing['kind'] == 'Listing' else None
+                except (KeyError, TypeError, IndexError):
+                    post_children = None
+                
+                if post_children is None:
+                    if not isinstance(data, list) or len(data) < 1:
+                        print(f"  Warning: Line {line_num} is not in expected Reddit API format")
+                        continue
+                    
+                    # First element should be posts listing
+                    posts_listing = data[0]
+                    if not posts_listing or posts_listing.get('kind') != 'Listing':
+                        print(f"  Warning: Line {line_num} does not contain a posts listing")
+                        continue
+                    post_children = posts_listing['data'].get('children', [])
                 
-                # First element should be posts listing
-                posts_listing = data[0] if len(data) > 0 else None
                 # Second element should be comments listing (if present)
                 comments_listing = data[1] if len(data) > 1 else None
                 
-                if not posts_listing or posts_listing.get('kind') != 'Listing':
-                    print(f"  Warning: Line {line_num} does not contain a posts listing")
-                    continue
-                
                 # Process each post in the listing
-                for post_item in posts_listing['data'].get('children', []):
+                for post_item in post_children:
                     if post_item.get('kind') != 't3':
                         continue
                     
                     post_data = post_item.get('data', {})
                     
                     # Extract media URLs from post
-                    post_media = extract_media_from_reddit_post(post_data)
-                    all_media_urls.update(post_media)
+                    line_urls.extend(extract_media_from_reddit_post(post_data))
                     
                     # Extract media from comments
                     if comments_listing and comments_listing.get('kind') == 'Listing':
                         for comment_item in comments_listing['data'].get('children', []):
                             if comment_item.get('kind') == 't1':
                                 comment_data = comment_item.get('data', {})
-                                comment_media = extract_media_from_comment(comment_data)
-                                all_media_urls.update(comment_media)
+                                line_urls.extend(extract_media_from_comment(comment_data))
                                 
-                                # Also check replies recursively
-                                if 'replies' in comment_data and comment_data['replies']:
-                                    if isinstance(comment_data['replies'], dict) and comment_data['replies'].get('kind') == 'Listing':
-                                        def extract_from_replies(replies_listing):
-                                            for reply_item in replies_listing['data'].get('children', []):
-                                                if reply_item.get('kind') == 't1':
-                                                    reply_data = reply_item.get('data', {})
-                                                    reply_media = extract_media_from_comment(reply_data)
-                                                    all_media_urls.update(reply_media)
-                                                    if 'replies' in reply_data and reply_data['replies']:
-                                                        if isinstance(reply_data['replies'], dict) and reply_data['replies'].get('kind') == 'Listing':
-                                                            extract_from_replies(reply_data['replies'])
-                                        extract_from_replies(comment_data['replies'])
+                                # Also check replies at every depth
+                                if comment_data.get('replies'):
+                                    _extract_media_from_replies(comment_data['replies'], line_urls)
                     
                     # Store post data for later processing
                     post_id = post_data.get('name', '')
                     if post_id:
+                        selftext_len = len(post_data.get('selftext') or '')
                         # If post already exists, we'll merge comments later
-                        if post_id not in posts_data:
-                            posts_data[post_id] = {
+                        post_info = posts_data.get(post_id)
+                        if post_info is None:
+                            post_info = posts_data[post_id] = {
                                 'post_item': post_item,
-                                'comments_listings': []
+                                'comments_listings': [],
+                                '_selftext_len': selftext_len
                             }
+                        # Keep the most complete post_item (prefer one with more data),
+                        # comparing against the stored length of the kept selftext
+                        elif selftext_len > post_info['_selftext_len']:
+                            post_info['post_item'] = post_item
+                            post_info['_selftext_len'] = selftext_len
                         # Add this comments listing to the list (we'll merge them later)
                         if comments_listing:
-                            posts_data[post_id]['comments_listings'].append(comments_listing)
-                        # Keep the most complete post_item (prefer one with more data)
-                        existing_item = posts_data[post_id]['post_item']
-                        if len(str(post_data.get('selftext', ''))) > len(str(existing_item.get('data', {}).get('selftext', ''))):
-                            posts_data[post_id]['post_item'] = post_item
+                            post_info['comments_listings'].append(comments_listing)
                         
             except json.JSONDecodeError as e:
                 print(f"  Warning: Line {line_num} contains invalid JSON: {e}")
@@ -1111,6 +1686,9 @@ def load_jsonl_file(input_file, posts_data, all_media_urls):
             except Exception as e:
                 print(f"  Warning: Line {line_num} caused an error: {e}")
                 continue
+            finally:
+                # Posts stored before an error still need their media
+                all_media_urls.update(line_urls)
     
     print(f"✓ Processed posts from {input_file}")
 
@@ -1128,9 +1706,10 @@ def get_input_files(input_paths):
                 print(f"  Warning: {path} is not a .jsonl file, skipping...")
         elif path_obj.is_dir():
             # Find all JSONL files in directory
-            jsonl_files = list(path_obj.glob('*.jsonl'))
+            with os.scandir(path_obj) as entries:
+                jsonl_files = [entry.path for entry in entries if entry.name.endswith('.jsonl') and entry.is_file()]
             if jsonl_files:
-                input_files.extend([str(f) for f in jsonl_files])
+                input_files.extend(jsonl_files)
                 print(f"  Found {len(jsonl_files)} JSONL files in {path}")
             else:
                 print(f"  Warning: No .jsonl files found in {path}")
@@ -1259,6 +1838,9 @@ Examples:
                 relative_path = os.path.join(args.media_dir, media_filename) if hasattr(args, 'media_dir') else os.path.relpath(local_path, output_dir)
             url_replacements[url] = relative_path
     
+    # Built once so every body is rewritten in a single pass
+    url_matcher = build_url_matcher(url_replacements)
+    
     # Second pass: Parse posts with URL replacements and merge comments
     print("\nProcessing posts with downloaded media and merging comments...")
     posts = {}
@@ -1269,35 +1851,27 @@ Examples:
         
         if not comments_listings:
             # No comments, just parse the post
-            post = parse_reddit_post(post_info['post_item'], None, url_replacements, str(media_dir))
+            post = parse_reddit_post(post_info['post_item'], None, url_replacements, str(media_dir), url_matcher)
             if post:
                 posts[post_id] = post
         else:
             # Parse post with first comments listing
-            post = parse_reddit_post(post_info['post_item'], comments_listings[0], url_replacements, str(media_dir))
+            post = parse_reddit_post(post_info['post_item'], comments_listings[0], url_replacements, str(media_dir), url_matcher)
             
             if post:
                 # Merge comments from all listings
                 merged_comment_tree = post['comment_tree']
                 for comments_listing in comments_listings[1:]:
-                    # Parse comments from this listing
-                    temp_post = parse_reddit_post(post_info['post_item'], comments_listing, url_replacements, str(media_dir))
-                    if temp_post:
-                        # Merge comment trees
-                        merged_comment_tree = merge_comment_trees(merged_comment_tree, temp_post['comment_tree'])
+                    # Only the comments are needed from the extra listings
+                    merged_comment_tree = merge_comment_trees(merged_comment_tree, build_comment_tree(comments_listing))
                 
+                # Rewrite media in the merged comments once
+                embed_media_in_comment_tree(merged_comment_tree, url_replacements, str(media_dir), url_matcher)
                 post['comment_tree'] = merged_comment_tree
                 posts[post_id] = post
                 
                 # Count total comments for logging
-                def count_comments(tree):
-                    count = len(tree)
-                    for comment in tree.values():
-                        if comment.get('replies'):
-                            count += sum(1 for _ in comment['replies'])
-                    return count
-                
-                total_comments = count_comments(merged_comment_tree)
+                total_comments = count_all_comments(merged_comment_tree)
                 print(f"  Post {post_id}: {total_comments} total comments (merged from {len(comments_listings)} sources)")
     
     print(f"\nGenerating HTML visualization: {output_file}")